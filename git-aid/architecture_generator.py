@@ -1,10 +1,12 @@
 from concurrent.futures import ThreadPoolExecutor
+import json
 import os
+import re
 import openai
 import sys
 
 from tqdm import tqdm
-from llm_utils import message_llm
+from llm_utils import print_tier_stats, route_llm
 from github_utils import extract_files_from_url
 from dotenv import load_dotenv
 from github import Github
@@ -21,37 +23,31 @@ JSON_SCHEMA = """{
     {
       "Filename": "example.py",
       "description": "A brief explanation of the file's purpose."
-    },
-    ...
+    }
+  ],
   "functions": [
     {
       "function": "def example_function(example: str) -> str:",
       "description": "A brief explanation of the function."
-    },
-    ...
+    }
   ],
   "classes": [
     {
       "name": "class_name",
       "description": "A brief explanation of the class."
-    },
-    ...
+    }
   ],
   "global_variables": [
     {
       "name": "global_variable_name",
       "description": "A brief explanation of the global variable."
-    },
-    ...
+    }
   ],
   "constants": [
     {
       "name": "constant_name",
       "description": "A brief explanation of the constant."
-    },
-    ...
-  ],
-  ],
+    }
   ]
 }"""
 
@@ -59,16 +55,45 @@ SYSTEM_PROMPT = f"""Given a Python script, provide a JSON object containing all
 
 Add typing to all functions listed.
 
-Only respond with JSON in the format below with no explanation:
+Only respond with JSON in the format below with no explanation and no code block. Include one entry per element in each list:
 
 Output format:
 {JSON_SCHEMA}
 """
 
-def generate_architecture(file_name, file_contents):
-    # Given a file, generate an architecture
-    user_prompt = f"""File: {file_name}\n\n{file_contents}"""
-    return message_llm(SYSTEM_PROMPT, user_prompt)
+def strip_code_fences(text):
+    # Models often wrap JSON in a ```json block despite being asked not to
+    match = re.match(r"^```[\w-]*\n(.*?)\n?```$", text.strip(), re.DOTALL)
+    return match.group(1).strip() if match else text.strip()
+
+def is_valid_json(text):
+    try:
+        json.loads(strip_code_fences(text))
+    except ValueError:
+        return False
+    return True
+
+def read_file_contents(file):
+    # Returns None for binary files and files too large for the contents API
+    try:
+        return file.decoded_content.decode("utf-8")
+    except (AssertionError, AttributeError, TypeError, UnicodeDecodeError):
+        return None
+
+def generate_architecture(file):
+    # Given a file, generate an architecture, starting with the cheap model and escalating if it returns invalid JSON
+    file_contents = read_file_contents(file)
+    if file_contents is None:
+        tqdm.write(f"Skipping {file.path}: not a UTF-8 text file under 1 MB")
+        return None
+
+    user_prompt = f"""File: {file.name}\n\n{file_contents}"""
+    try:
+        architecture = route_llm(SYSTEM_PROMPT, user_prompt, validate=is_valid_json)
+    except ValueError as e:
+        tqdm.write(f"Skipping {file.path}: {e}")
+        return None
+    return strip_code_fences(architecture)
 
 def main(repo_url):
     # Given the provided repo, scrape all files and generate an architetcture for each one
@@ -79,7 +104,7 @@ def main(repo_url):
     with ThreadPoolExecutor() as executor:
         architectures = list(
             tqdm(
-                executor.map(generate_architecture, files, (file.name for file in files)),
+                executor.map(generate_architecture, files),
                 total=len(files),
                 desc="Processing Files",
             )
@@ -98,10 +123,13 @@ def main(repo_url):
 
     # Save all the architectures to individual files
     for file, architecture in zip(files, architectures):
+        if architecture is None:
+            continue
         file_path = os.path.join(repo_dir, file.name)
         with open(file_path, "w") as f:
             f.write(architecture)
     
+    print_tier_stats()
     print("Finished!")
         
 
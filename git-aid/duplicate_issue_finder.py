@@ -1,5 +1,8 @@
 import requests
+import csv
 import json
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 from gensim import corpora, models, similarities
 import numpy as np
 from tqdm import tqdm
@@ -15,6 +18,13 @@ import os
 
 load_dotenv()
 
+# Corpora smaller than this are tokenized in-process; the pool startup isn't worth it
+PARALLEL_TOKENIZE_MIN_ISSUES = 500
+# Corpora larger than this use a sharded on-disk index instead of an in-memory sparse one
+SHARDED_INDEX_MIN_ISSUES = 20000
+# Documents per on-disk shard; only one shard is held in memory while it is being built
+SHARDED_INDEX_SHARD_SIZE = 5000
+
 def fetch_open_issues(owner, repo, since_days=30):
     """Fetch all open issues from the specified GitHub repository."""
     issues = []
@@ -67,64 +77,141 @@ def extract_issue_texts(issues):
 def tokenize(text):
     return gensim.utils.simple_preprocess(remove_stopwords(text), deacc=True)
 
-def create_corpus(issue_texts):
-    """Create a dictionary and corpus for similarity computation."""
-    dictionary = corpora.Dictionary([tokenize(text) for text in issue_texts])
-    return dictionary, [dictionary.doc2bow(tokenize(text)) for text in issue_texts]
-
-def compute_similarity_matrix(corpus):
-    """Train a TF-IDF model and compute the similarity matrix."""
-    tfidf = models.TfidfModel(corpus)
-    return similarities.MatrixSimilarity(tfidf[corpus])
+def stream_tokens(issue_texts, workers=None):
+    """Tokenize issue texts, yielding token lists in order. Large inputs are spread across a process pool."""
+    if workers == 1 or len(issue_texts) < PARALLEL_TOKENIZE_MIN_ISSUES:
+        yield from map(tokenize, issue_texts)
+        return
 
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(tokenize, issue_texts, chunksize=64)
 
+def create_corpus(issue_texts, workers=None):
+    """Create a dictionary and corpus for similarity computation, tokenizing each text once."""
+    dictionary = corpora.Dictionary()
+    # allow_update grows the dictionary while converting, so the tokens are never needed twice
+    corpus = [dictionary.doc2bow(tokens, allow_update=True) for tokens in stream_tokens(issue_texts, workers)]
+    return dictionary, corpus
 
-def find_duplicate_issues(issues, issue_texts, similarity_threshold=0.7, top_n=5):
-    """Find and print duplicate issues based on the similarity threshold."""
-    dictionary, corpus = create_corpus(issue_texts)
+def compute_similarity_matrix(corpus, num_features, index_dir):
+    """Train a TF-IDF model and build a sparse similarity index, sharded into index_dir for large corpora."""
+    tfidf = models.TfidfModel(corpus)
+    if len(corpus) >= SHARDED_INDEX_MIN_ISSUES:
+        output_prefix = os.path.join(index_dir, "shard")
+        return similarities.Similarity(
+            output_prefix, tfidf[corpus], num_features=num_features, shardsize=SHARDED_INDEX_SHARD_SIZE
+        )
+    return similarities.SparseMatrixSimilarity(tfidf[corpus], num_features=num_features)
+
+
+def cluster_duplicate_issues(num_issues, edges):
+    """Group issues into clusters using union-find over the above-threshold similarity edges."""
+    parent = list(range(num_issues))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i, j in edges:
+        root_i, root_j = find(i), find(j)
+        if root_i != root_j:
+            parent[root_j] = root_i
+
+    clusters = {}
+    for i in range(num_issues):
+        clusters.setdefault(find(i), []).append(i)
+    return [members for members in clusters.values() if len(members) > 1]
+
+def build_cluster_records(clusters, text_issues):
+    """Describe each cluster, using its oldest (lowest-numbered) issue as the canonical representative."""
+    records = []
+    for members in clusters:
+        cluster_issues = sorted((text_issues[i] for i in members), key=lambda issue: issue['number'])
+        canonical = cluster_issues[0]
+        records.append({
+            'canonical': canonical['number'],
+            'canonical_url': canonical['html_url'],
+            'size': len(cluster_issues),
+            'issues': [{'number': issue['number'], 'title': issue['title'], 'html_url': issue['html_url']} for issue in cluster_issues],
+        })
+    return sorted(records, key=lambda record: (-record['size'], record['canonical']))
+
+def write_clusters(records, output_path):
+    """Write duplicate clusters to a CSV file (one row per issue) or, for any other extension, JSON."""
+    if output_path.lower().endswith('.csv'):
+        with open(output_path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['canonical', 'issue_number', 'title', 'html_url'])
+            for record in records:
+                for issue in record['issues']:
+                    writer.writerow([record['canonical'], issue['number'], issue['title'], issue['html_url']])
+    else:
+        with open(output_path, 'w') as f:
+            json.dump(records, f, indent=2)
+
+def positive_int(value):
+    """Argparse type for options that must be at least 1."""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return number
+
+def find_duplicate_issues(issues, issue_texts, similarity_threshold=0.7, top_n=5, workers=None, clusters_output=None):
+    """Find and print duplicate issues based on the similarity threshold, returning the duplicate clusters."""
+    dictionary, corpus = create_corpus(issue_texts, workers)
     
     # Add check for empty corpus
     if not corpus:
         print("No issues found for processing. Exiting.")
-        return
-
-    index = compute_similarity_matrix(corpus)
+        return []
 
-    issue_texts_mapping = {i: issue for i, issue in enumerate(issues) if 'pull_request' not in issue}
-    index_mapping = list(issue_texts_mapping.keys())
+    text_issues = [issue for issue in issues if 'pull_request' not in issue]
     num_issues = len(issue_texts)
-    num_duplicates = 0
     similarity_sum = 0
     similarity_count = 0
-    duplicate_pairs = set()
-    similarity_scores = []
-    top_pairs = []
-
-    for i in tqdm(range(num_issues), desc="Processing issues"):
-        issue1 = issue_texts_mapping[index_mapping[i]]
-        similarities = index[corpus[i]]
-        for j, issue2 in enumerate(issue_texts):
-            if i != j:
-                similarity_sum += similarities[j]
-                similarity_count += 1
-                similarity_scores.append(similarities[j])
-                if similarities[j] > similarity_threshold:
-                    duplicate_pairs.add(tuple(sorted((issue1['number'], issue_texts_mapping[index_mapping[j]]['number']))))
-                    top_pairs.append(((issue1['number'], issue_texts_mapping[index_mapping[j]]['number']), similarities[j], issue1['html_url'], issue_texts_mapping[index_mapping[j]]['html_url']))
-
-    mean_similarity = similarity_sum / similarity_count
+    # Best score for each above-threshold pair, keyed by (lower index, higher index)
+    edges = {}
+
+    # Any on-disk shards are removed once the index has been queried
+    with tempfile.TemporaryDirectory(prefix="duplicate_issues_") as index_dir:
+        index = compute_similarity_matrix(corpus, len(dictionary), index_dir)
+
+        for i in tqdm(range(num_issues), desc="Processing issues"):
+            similarities = index[corpus[i]]
+            similarity_sum += float(similarities.sum() - similarities[i])
+            similarity_count += num_issues - 1
+            for j in np.nonzero(similarities > similarity_threshold)[0]:
+                if i != j:
+                    pair = (min(i, j), max(i, j))
+                    edges[pair] = max(edges.get(pair, 0), float(similarities[j]))
+
+        # Release the memory-mapped shards so the directory can be removed on Windows
+        del index
+
+    mean_similarity = similarity_sum / similarity_count if similarity_count else 0
     print(f"\nNumber of issues checked: {num_issues}")
-    print(f"Number of possible duplicates found: {len(duplicate_pairs)}")
+    print(f"Number of possible duplicates found: {len(edges)}")
     print(f"Mean similarity: {mean_similarity:.2f}")
 
     # Get the top N duplicate pairs based on similarity scores
-    top_pairs = nlargest(top_n, top_pairs, key=lambda x: x[1])
+    top_pairs = nlargest(top_n, edges.items(), key=lambda x: x[1])
 
     print(f"\nTop {top_n} potential duplicate pairs:")
-    for pair in top_pairs:
-        print(f"Issue {pair[0][0]} and Issue {pair[0][1]} might be duplicates with a similarity score of {pair[1]:.2f}")
-        print(f"Link to Issue {pair[0][0]}: {pair[2]}")
-        print(f"Link to Issue {pair[0][1]}: {pair[3]}\n")
+    for (i, j), score in top_pairs:
+        issue1, issue2 = text_issues[i], text_issues[j]
+        print(f"Issue {issue1['number']} and Issue {issue2['number']} might be duplicates with a similarity score of {score:.2f}")
+        print(f"Link to Issue {issue1['number']}: {issue1['html_url']}")
+        print(f"Link to Issue {issue2['number']}: {issue2['html_url']}\n")
+
+    clusters = build_cluster_records(cluster_duplicate_issues(num_issues, edges), text_issues)
+    print(f"Duplicate clusters found: {len(clusters)}")
+    if clusters_output:
+        write_clusters(clusters, clusters_output)
+        print(f"Clusters written to {clusters_output}")
+
+    return clusters
 
 
 
@@ -135,12 +222,14 @@ if __name__ == '__main__':
     parser.add_argument('--days', metavar='DAYS', type=int, default=30, help='Number of days to look back for issues (default: 30)')
     parser.add_argument('--threshold', metavar='THRESHOLD', type=float, default=0.7, help='Similarity threshold for duplicate issues (default: 0.7)')
     parser.add_argument('--top_n', metavar='TOP_N', type=int, default=5, help='Number of top duplicate pairs to show (default: 5)')
+    parser.add_argument('--clusters_output', metavar='PATH', type=str, default=None, help='Write duplicate clusters to PATH as CSV (.csv) or JSON (any other extension)')
+    parser.add_argument('--workers', metavar='WORKERS', type=positive_int, default=None, help='Number of tokenizer processes (default: one per CPU)')
 
     args = parser.parse_args()
     owner, repo = args.owner, args.repo
-    days, threshold, top_n = args.days, args.threshold, args.top_n
+    days, threshold, top_n, workers = args.days, args.threshold, args.top_n, args.workers
 
     print("Fetching issues...")
     issues = fetch_open_issues(owner, repo, days)
     issue_texts = extract_issue_texts(issues)
-    find_duplicate_issues(issues, issue_texts, threshold, top_n)
+    find_duplicate_issues(issues, issue_texts, threshold, top_n, workers, args.clusters_output)
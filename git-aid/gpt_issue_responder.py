@@ -8,10 +8,12 @@ import time
 import requests
 import openai
 from dotenv import load_dotenv
-from typing import List, Dict, Union
+from typing import Callable, List, Dict, Optional, Union
 import logging
 import argparse
 
+from llm_utils import print_tier_stats, print_token, route_llm, stream_llm
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -54,27 +56,33 @@ def get_issue_comments(repo_owner: str, repo_name: str, issue_number: int) -> Li
     else:
         raise GitHubAPIError(f"Failed to fetch comments: {response.content}")
 
-def generate_gpt4_response(prompt: str) -> str:
-    messages = [
-        {
-            "role": "system",
-            "content": """You are AI-GitHub-Issue-Helper.\nYour job is to take in a GitHub issue from the user and respond.""",
-        },
-        {"role": "user", "content": prompt},
-    ]
+SYSTEM_PROMPT = """You are AI-GitHub-Issue-Helper.\nYour job is to take in a GitHub issue from the user and respond."""
 
+def generate_gpt4_response(prompt: str, progress_callback: Optional[Callable] = None) -> str:
+    """
+    Generates a response to the issue prompt, using the cheaper model for short issues.
+    If progress_callback is given, the response is streamed through it token by token.
+    """
     # logging.info(f"Generating response for prompt: {prompt}")
 
+    if progress_callback:
+        try:
+            response, time_to_first_token = stream_llm(
+                SYSTEM_PROMPT, prompt, progress_callback=progress_callback
+            )
+        except Exception as e:
+            raise GPT4Error(f"Error generating response: {e}")
+        # End the streamed line before anything else is written to the terminal
+        progress_callback("\n")
+        if time_to_first_token is not None:
+            logging.info(f"Time to first token: {time_to_first_token:.2f}s")
+        return response
+
     try:
-        response = openai.ChatCompletion.create(
-            model="gpt-4",
-            messages=messages,
-        )
+        return route_llm(SYSTEM_PROMPT, prompt)
     except Exception as e:
         raise GPT4Error(f"Error generating response: {e}")
 
-    return response.choices[0].message["content"]
-
 def post_github_comment(repo_owner: str, repo_name: str, issue_number: int, body: str) -> None:
     disclaimer = "\n\n---\n\n*This response was generated by [AI-GitHub-Interlocutor](https://github.com/Torantulino/AGI) and may not be accurate or appropriate. The author of this repository and the creator of the AI model assume no responsibility or liability for any consequences arising from the use of the information provided in this response. 🤖*"
     body += disclaimer
@@ -90,7 +98,7 @@ def post_github_comment(repo_owner: str, repo_name: str, issue_number: int, body
     else:
         raise GitHubAPIError(f"Failed to post comment: {response.content}")
 
-def display_comments_and_ai_response(issue: Dict[str, Union[str, int]], repo_owner: str, repo_name: str) -> str:
+def display_comments_and_ai_response(issue: Dict[str, Union[str, int]], repo_owner: str, repo_name: str, stream: bool = False) -> Optional[str]:
     comments = get_issue_comments(repo_owner, repo_name, issue["number"])
 
     full_text = issue["body"] + "\n\n".join(
@@ -98,6 +106,20 @@ def display_comments_and_ai_response(issue: Dict[str, Union[str, int]], repo_own
     )
 
     prompt = f"GitHub issue: {issue['title']}\n {full_text}"
+
+    if stream:
+        print("===========================================================================")
+        print(f"Issue {issue['number']}:\n{prompt}\n-------------------------------------------------------------\nAI-generated response:")
+        try:
+            response = generate_gpt4_response(prompt, progress_callback=print_token)
+        except KeyboardInterrupt:
+            # Let the operator abort a bad response without waiting for it to finish
+            print()
+            logging.info(f"Aborted response on issue {issue['number']}")
+            return None
+        print("===========================================================================")
+        return response
+
     response = generate_gpt4_response(prompt)
     
     print("===========================================================================")
@@ -110,7 +132,7 @@ def user_confirmation() -> bool:
     user_input = input("Post this response? (Y/N): ")
     return user_input.lower() == 'y'
 
-def process_issue(issue: Dict[str, Union[str, int]], repo_owner: str, repo_name: str) -> None:
+def process_issue(issue: Dict[str, Union[str, int]], repo_owner: str, repo_name: str, stream: bool = False) -> None:
     comments = get_issue_comments(repo_owner, repo_name, issue["number"])
 
     bot_already_commented = any(
@@ -118,8 +140,10 @@ def process_issue(issue: Dict[str, Union[str, int]], repo_owner: str, repo_name:
     )
 
     if not bot_already_commented:
-        response = display_comments_and_ai_response(issue, repo_owner, repo_name)
-        if user_confirmation():
+        response = display_comments_and_ai_response(issue, repo_owner, repo_name, stream)
+        if response is None:
+            logging.info(f"Skipped posting response on issue {issue['number']}")
+        elif user_confirmation():
             post_github_comment(repo_owner, repo_name, issue["number"], response)
         else:
             logging.info(f"Skipped posting response on issue {issue['number']}")
@@ -130,6 +154,7 @@ def main() -> None:
     parser = argparse.ArgumentParser(description="AI GitHub Issue Helper")
     parser.add_argument("repo_owner", help="GitHub repository owner's username")
     parser.add_argument("repo_name", help="GitHub repository name")
+    parser.add_argument("--stream", action="store_true", help="Print AI responses as they are generated")
 
     args = parser.parse_args()
 
@@ -138,11 +163,13 @@ def main() -> None:
         logging.info(f"Found {len(issues)} issues")
 
         for issue in issues:
-            process_issue(issue, args.repo_owner, args.repo_name)
+            process_issue(issue, args.repo_owner, args.repo_name, args.stream)
 
     except (GitHubAPIError, GPT4Error) as e:
         logging.error(f"Error: {str(e)}")
 
+    print_tier_stats()
+
 if __name__ == "__main__":
     main()
 
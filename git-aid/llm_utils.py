@@ -1,4 +1,10 @@
+import re
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
 import openai
+import openai.error
 
 def message_llm(
         system_prompt: str,
@@ -19,4 +25,205 @@ def message_llm(
         max_tokens=max_tokens,
     )
 
-    return response.choices[0]['message']['content'].strip()
\ No newline at end of file
+    return response.choices[0]['message']['content'].strip()
+
+def print_token(token: str) -> None:
+    # Renders streamed tokens on one line as they arrive
+    print(token, end="", flush=True)
+
+# Models tried in order by route_llm, cheapest first
+MODEL_TIERS = ["gpt-3.5-turbo", "gpt-4"]
+# Context window of each model, in tokens
+MODEL_CONTEXT_TOKENS = {"gpt-3.5-turbo": 4096, "gpt-4": 8192}
+# USD per 1K (prompt, completion) tokens
+MODEL_PRICING = {"gpt-3.5-turbo": (0.002, 0.002), "gpt-4": (0.03, 0.06)}
+# Prompts estimated above this many tokens skip the cheap tier
+CHEAP_MODEL_MAX_PROMPT_TOKENS = 1500
+# Prompts with more lines than this skip the cheap tier
+CHEAP_MODEL_MAX_PROMPT_LINES = 200
+# Prompts with more definitions or diff hunks than this skip the cheap tier
+CHEAP_MODEL_MAX_COMPLEXITY = 15
+
+# Lines that open a code definition or a unified diff hunk
+STRUCTURE_PATTERN = re.compile(r"^\s*(?:async\s+def|def|class|function|func|fn)\s|^@@ ", re.MULTILINE)
+
+_tier_stats = {}
+_tier_stats_lock = threading.Lock()
+
+def estimate_tokens(text: str) -> int:
+    # Roughly four characters per token for English text and code
+    return len(text) // 4
+
+def estimate_complexity(text: str) -> int:
+    # Number of code definitions and diff hunks; prose scores zero
+    return len(STRUCTURE_PATTERN.findall(text))
+
+def choose_model(system_prompt: str, prompt: str) -> str:
+    """
+    Picks the cheapest tier suitable for the prompt, based on its estimated size, line count and structural complexity.
+
+    :return: The model name to start with.
+    """
+    if (
+        estimate_tokens(system_prompt + prompt) <= CHEAP_MODEL_MAX_PROMPT_TOKENS
+        and prompt.count("\n") < CHEAP_MODEL_MAX_PROMPT_LINES
+        and estimate_complexity(prompt) <= CHEAP_MODEL_MAX_COMPLEXITY
+    ):
+        return MODEL_TIERS[0]
+    return MODEL_TIERS[-1]
+
+def fit_max_tokens(model: str, system_prompt: str, prompt: str, max_tokens: int = 3000) -> int:
+    """
+    Caps max_tokens so the prompt and completion fit in the model's context window.
+
+    :raises ValueError: If the prompt alone is too large for the model.
+    """
+    prompt_tokens = estimate_tokens(system_prompt + prompt)
+    # Leave a margin because the token estimate is approximate
+    available_tokens = MODEL_CONTEXT_TOKENS[model] - prompt_tokens - 100
+    if available_tokens < 1:
+        raise ValueError(
+            f"Prompt of about {prompt_tokens} tokens is too large for {model} "
+            f"({MODEL_CONTEXT_TOKENS[model]} token context)"
+        )
+    return min(max_tokens, available_tokens)
+
+def record_tier_usage(model: str, latency: float, prompt_tokens: int = 0, completion_tokens: int = 0, escalated: bool = False) -> None:
+    prompt_price, completion_price = MODEL_PRICING.get(model, (0, 0))
+    cost = (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1000
+    with _tier_stats_lock:
+        stats = _tier_stats.setdefault(
+            model, {"calls": 0, "escalations": 0, "latency": 0.0, "prompt_tokens": 0, "completion_tokens": 0, "cost": 0.0}
+        )
+        stats["calls"] += 1
+        stats["escalations"] += int(escalated)
+        stats["latency"] += latency
+        stats["prompt_tokens"] += prompt_tokens
+        stats["completion_tokens"] += completion_tokens
+        stats["cost"] += cost
+
+def get_tier_stats() -> Dict[str, Dict[str, float]]:
+    """
+    Returns a copy of the per-model call counts, escalations, total latency (seconds), token usage and cost (USD).
+    """
+    with _tier_stats_lock:
+        return {model: dict(stats) for model, stats in _tier_stats.items()}
+
+def print_tier_stats() -> None:
+    for model, stats in get_tier_stats().items():
+        average_latency = stats["latency"] / stats["calls"]
+        print(
+            f"{model}: {stats['calls']} calls, {stats['escalations']} escalated, "
+            f"{average_latency:.2f}s average latency, ${stats['cost']:.4f}"
+        )
+
+def has_content(response: str) -> bool:
+    # Default route_llm validator: reject empty responses
+    return bool(response)
+
+def route_llm(
+        system_prompt: str,
+        prompt: str,
+        validate: Optional[Callable[[str], bool]] = has_content,
+        temperature=0.7,
+        max_tokens=3000,
+    ) -> str:
+    """
+    Sends the prompt to the cheapest suitable model. Escalates to the next tier if validation rejects the output
+    or the request is invalid for the cheaper model (e.g. its context window is too small); other API errors are raised.
+
+    :param validate: Returns True if a response is acceptable. Responses from the last tier are not validated.
+    :return: The response text.
+    """
+    tiers = MODEL_TIERS[MODEL_TIERS.index(choose_model(system_prompt, prompt)):]
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": prompt},
+    ]
+
+    for tier, model in enumerate(tiers):
+        is_last_tier = tier == len(tiers) - 1
+        start_time = time.perf_counter()
+        try:
+            response = openai.ChatCompletion.create(
+                model=model,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=fit_max_tokens(model, system_prompt, prompt, max_tokens),
+            )
+        except openai.error.InvalidRequestError:
+            record_tier_usage(model, time.perf_counter() - start_time, escalated=not is_last_tier)
+            if is_last_tier:
+                raise
+            continue
+        except openai.error.OpenAIError:
+            # Rate limits, auth and connection errors would hit the larger model too, at a higher price
+            record_tier_usage(model, time.perf_counter() - start_time)
+            raise
+
+        content = response.choices[0]['message']['content'].strip()
+        accepted = is_last_tier or validate is None or validate(content)
+        usage = response.get("usage", {})
+        record_tier_usage(
+            model,
+            time.perf_counter() - start_time,
+            usage.get("prompt_tokens", 0),
+            usage.get("completion_tokens", 0),
+            escalated=not accepted,
+        )
+        if accepted:
+            return content
+
+def stream_llm(
+        system_prompt: str,
+        prompt: str,
+        model: Optional[str] = None,
+        temperature=0.7,
+        max_tokens=3000,
+        progress_callback: Optional[Callable] = None,
+    ) -> Tuple[str, Optional[float]]:
+    """
+    Streams a chat completion, passing each token to the callback as soon as it arrives.
+    A streamed response has already been shown, so it is never escalated to another tier.
+
+    :param model: The model to use, or None to pick a tier with choose_model.
+    :param progress_callback: Called with each token as it arrives, e.g. print_token.
+    :return: The full response text and the time to first token in seconds (None if nothing was received).
+    """
+    if model is None:
+        model = choose_model(system_prompt, prompt)
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": prompt},
+    ]
+
+    start_time = time.perf_counter()
+    response = openai.ChatCompletion.create(
+        model=model,
+        messages=messages,
+        temperature=temperature,
+        max_tokens=fit_max_tokens(model, system_prompt, prompt, max_tokens),
+        stream=True,
+    )
+
+    tokens = []
+    time_to_first_token = None
+    for chunk in response:
+        token = chunk.choices[0]['delta'].get('content')
+        if not token:
+            continue
+        if time_to_first_token is None:
+            time_to_first_token = time.perf_counter() - start_time
+        tokens.append(token)
+        if progress_callback:
+            progress_callback(token)
+
+    content = "".join(tokens).strip()
+    # Streamed responses don't report usage, so estimate it for the cost figures
+    record_tier_usage(
+        model,
+        time.perf_counter() - start_time,
+        estimate_tokens(system_prompt + prompt),
+        estimate_tokens(content),
+    )
+    return content, time_to_first_token
@@ -1,6 +1,6 @@
+import argparse
 import os
-import sys
-from typing import Callable
+from typing import Callable, Optional
 
 import openai
 import requests
@@ -9,6 +9,8 @@ from dotenv import load_dotenv
 from html2text import html2text
 from markdown import markdown
 
+from llm_utils import print_tier_stats, print_token, route_llm, stream_llm
+
 
 load_dotenv()
 
@@ -54,7 +56,12 @@ class PRReviewer:
         raw_diff = response.text
         return raw_diff
 
-    def review_pull_request(self, pr_url: str, progress_callback: Callable = print):
+    def review_pull_request(
+        self, pr_url: str, progress_callback: Optional[Callable] = None, stream: bool = False
+    ):
+        if progress_callback is None:
+            progress_callback = print_token if stream else print
+
         diff_url, description, title = self.extract_pr_info(pr_url)
 
         diff = self.fetch_and_parse_diff(diff_url)
@@ -86,19 +93,37 @@ Your task is to:
 
 Remember, your goal is to help the developer improve their code by providing constructive feedback and guidance.
 """
-        result = self.message_prreviewer(
-            system_prompt=system_prompt, prompt=context_message
-        )
+        # Small diffs go to the cheaper model first
+        if stream:
+            # Show tokens as they arrive instead of waiting for the full review
+            progress_callback("\nCode Review Results:\n")
+            result, time_to_first_token = stream_llm(
+                system_prompt=system_prompt,
+                prompt=context_message,
+                progress_callback=progress_callback,
+            )
+            if time_to_first_token is not None:
+                progress_callback(f"\n\nTime to first token: {time_to_first_token:.2f}s\n")
+        else:
+            result = route_llm(system_prompt=system_prompt, prompt=context_message)
+
+        # Streamed tokens are shown as raw markdown; both modes return the rendered text
         result_html = markdown(result)
         result_text = html2text(result_html).strip()
-        print("\nCode Review Results:\n", result_text)
+        if not stream:
+            progress_callback(f"\nCode Review Results:\n{result_text}")
+        return result_text
 
 
 if __name__ == "__main__":
     OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
     openai.api_key = OPENAI_API_KEY
 
-    pr_url = sys.argv[1]  # Replace with the GitHub Pull Request URL you want to review
+    parser = argparse.ArgumentParser(description="Review a GitHub pull request.")
+    parser.add_argument("pr_url", help="GitHub Pull Request URL to review")
+    parser.add_argument("--stream", action="store_true", help="Print the review as it is generated")
+    args = parser.parse_args()
 
     code_review_assistant = PRReviewer()
-    code_review_assistant.review_pull_request(pr_url)
+    code_review_assistant.review_pull_request(args.pr_url, stream=args.stream)
+    print_tier_stats()